@@ -2,17 +2,21 @@ import os
 import re
 import json
 import logging
+import math
+import threading
 import time
-from typing import Optional, Dict, List, Any, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Any, Tuple, Callable
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import gspread
-from gspread.exceptions import WorksheetNotFound
-from google.oauth2.service_account import Credentials
 import pandas as pd
 from datetime import date, datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 # Load environment variables (from .env when present)
@@ -41,7 +45,68 @@ if not all([GCP_CREDS_JSON, GROQ_API_KEY]):
         "ERRO CRÍTICO: Variáveis de ambiente ausentes. Defina GCP_SERVICE_ACCOUNT_JSON e GROQ_API_KEY."
     )
 
-app = FastAPI(title="Focus OS API")
+GSHEETS_SCOPES = (
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+)
+SPREADSHEET_KEY_RE = re.compile(r"/d/([a-zA-Z0-9-_]+)")
+# Dates are stored in the sheet as dd/mm/yyyy text
+SHEET_DATE_FORMAT = "%d/%m/%Y"
+GROQ_MODEL = "gemma2-9b-it"
+
+# Characters stripped from numeric sheet cells before parsing ("50 %" -> "50")
+PERCENT_JUNK_RE = re.compile(r"[%\s]")
+
+# Static prompt/label text, built once at import instead of per request
+WEEKDAY_NAMES_PT = ("Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado", "Domingo")
+COACH_PROMPT_TEMPLATE = (
+    'Você é o "System Coach" do Focus OS. Sua missão é gerar um plano tático e 2 flashcards. '
+    'Responda EXCLUSIVAMENTE em JSON com chaves "summary" e "flashcards" (lista de objetos com "q" e "a"). '
+    "MISSÃO: Matéria: {subject}, Atividade: {activity}"
+)
+ASK_SYSTEM_PROMPT = (
+    "Gere perguntas curtas para revisão médica. Responda EM JSON. Estrutura: "
+    "{\"questions\":[{\"type\":\"mcq|truefalse\",\"question\":\"...\",\"options\":[\"A\",\"B\",...],\"answer\":\"A|true|false\",\"explanation\":\"...\"}]}"
+)
+
+# One keep-alive session shared by every Groq call: reuses the TLS connection across requests
+GROQ_API_BASE = "https://api.groq.com/openai/v1"
+groq_session = requests.Session()
+groq_session.headers.update({"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"})
+# Pooled connections plus transport-level retries on rate limits / transient 5xx.
+# POST is safe to retry here: chat completions have no side effects. Read timeouts are
+# not retried and Retry-After is ignored, so a slow or throttled Groq falls back fast.
+groq_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=2,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        ),
+    ),
+)
+
+# Identical prompts (same subject/topic) are answered from memory instead of re-hitting Groq
+IA_CACHE_TTL_SECONDS = 3600
+IA_CACHE_MAX_ENTRIES = 512
+_ia_cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+_ia_cache_lock = threading.Lock()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    on_startup()
+    yield
+
+
+app = FastAPI(title="Focus OS API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -52,6 +117,24 @@ app.add_middleware(
 )
 
 
+def _init_app_state() -> None:
+    """Seed every app.state attribute read by the handlers, so lookups never need hasattr()."""
+    app.state.worksheet = None
+    app.state.gs_last_error = None
+    app.state.ia_online = False
+
+
+_init_app_state()
+
+
+def _require_worksheet(detail: str = "Serviço indisponível: planilha offline."):
+    """Return the cached worksheet or raise 503 when the Sheets connection is down."""
+    worksheet = app.state.worksheet
+    if worksheet is None:
+        raise HTTPException(status_code=503, detail=detail)
+    return worksheet
+
+
 def _redact(text: Optional[str]) -> str:
     if not text:
         return ""
@@ -66,7 +149,7 @@ def extract_spreadsheet_key(identifier: str) -> str:
         return ""
     if identifier.startswith("http"):
         # Try to capture the segment between '/d/' and the next '/'
-        match = re.search(r"/d/([a-zA-Z0-9-_]+)", identifier)
+        match = SPREADSHEET_KEY_RE.search(identifier)
         if match:
             return match.group(1)
         # If no match, return as-is; gspread can open_by_url
@@ -79,13 +162,14 @@ def init_gsheets_state() -> None:
     app.state.worksheet = None
     app.state.gs_last_error = None
     try:
+        # Imported here so loading the module (and IA-only code paths) skips the google-auth import cost
+        import gspread
+        from gspread.exceptions import WorksheetNotFound
+        from google.oauth2.service_account import Credentials
+
         logger.info("Inicializando autenticação com Google usando service account (email mascarado).")
         creds_dict = json.loads(GCP_CREDS_JSON)
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
+        creds = Credentials.from_service_account_info(creds_dict, scopes=GSHEETS_SCOPES)
         client = gspread.authorize(creds)
 
         identifier = SPREADSHEET_IDENTIFIER
@@ -124,13 +208,9 @@ def init_gsheets_state() -> None:
 
 
 def get_data_as_dataframe() -> pd.DataFrame:
-    if not hasattr(app.state, "worksheet") or app.state.worksheet is None:
-        raise HTTPException(
-            status_code=503,
-            detail="Serviço indisponível: conexão com a planilha falhou. Consulte /status para detalhes.",
-        )
-
-    worksheet = app.state.worksheet
+    worksheet = _require_worksheet(
+        "Serviço indisponível: conexão com a planilha falhou. Consulte /status para detalhes."
+    )
     logger.info("Solicitando dados da planilha '%s' via get_all_values()...", worksheet.title)
     all_values = worksheet.get_all_values()
     logger.info("Linhas retornadas (incl. cabeçalho): %d", len(all_values))
@@ -140,17 +220,51 @@ def get_data_as_dataframe() -> pd.DataFrame:
     headers = all_values[0]
     df = pd.DataFrame(all_values[1:], columns=headers)
     if "Data" in df.columns:
-        df["Data"] = pd.to_datetime(df["Data"], format="%d/%m/%Y", errors="coerce")
+        # Parsed values are midnight timestamps, so handlers compare against
+        # pd.Timestamp(day) directly instead of materializing .dt.date objects
+        df["Data"] = pd.to_datetime(df["Data"], format=SHEET_DATE_FORMAT, errors="coerce")
     else:
         logger.warning("Coluna 'Data' não encontrada na planilha. Datas serão ignoradas.")
     return df
 
 
+def _numeric_column(df: pd.DataFrame, column: str) -> pd.Series:
+    """Parse a sheet column such as '% Concluído' ("50%", "3", "7,5") into floats in one vectorized pass.
+
+    Missing columns and unparsable cells become NaN.
+    """
+    if column not in df.columns:
+        return pd.Series(float("nan"), index=df.index)
+    values = df[column]
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    # One regex pass drops '%' and whitespace; pt-BR decimal commas become dots
+    cleaned = values.astype(str).str.replace(PERCENT_JUNK_RE, "", regex=True).str.replace(",", ".", regex=False)
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def _user_mask(df: pd.DataFrame, user: str) -> pd.Series:
+    """Rows assigned to ``user`` or to 'Ambos' (case-insensitive); all rows when 'Aluno(a)' is absent.
+
+    The column only holds a handful of distinct names, so it is matched as a
+    categorical: only the categories are lower-cased and rows compare by code.
+    """
+    if "Aluno(a)" not in df.columns:
+        return pd.Series(True, index=df.index)
+    students = df["Aluno(a)"].astype("category")
+    categories = students.cat.categories
+    wanted = categories[categories.astype(str).str.lower().isin([user.lower(), "ambos"])]
+    return students.isin(wanted)
+
+
+def _optional_ints(values: pd.Series) -> List[Optional[int]]:
+    """Truncate parsed floats to int, mapping NaN and ±inf (e.g. an "inf" cell) to None for JSON output."""
+    return [int(v) if math.isfinite(v) else None for v in values.to_numpy()]
+
+
 def _get_sheet_snapshot() -> Tuple[List[str], List[List[str]]]:
     """Return (headers, rows) from the cached worksheet. Rows exclude header row."""
-    if not hasattr(app.state, "worksheet") or app.state.worksheet is None:
-        raise HTTPException(status_code=503, detail="Serviço indisponível: planilha offline.")
-    worksheet = app.state.worksheet
+    worksheet = _require_worksheet()
     all_values = worksheet.get_all_values()
     if not all_values:
         return [], []
@@ -158,90 +272,116 @@ def _get_sheet_snapshot() -> Tuple[List[str], List[List[str]]]:
     return headers, all_values[1:]
 
 
-def _find_row_index_for(date_obj: date, user: str) -> Optional[int]:
-    """Return 1-based sheet row index for the data row (including header offset)."""
-    df = get_data_as_dataframe()
-    if df.empty:
-        return None
-    if "Data" not in df.columns or "Aluno(a)" not in df.columns:
-        return None
-    mask = (df["Data"].dt.date == date_obj) & (
-        df["Aluno(a)"].str.lower() == user.lower()
-    )
-    if not mask.any():
+def _find_row_index_for(
+    date_obj: date,
+    user: str,
+    snapshot: Optional[Tuple[List[str], List[List[str]]]] = None,
+) -> Optional[int]:
+    """Return 1-based sheet row index for the data row (including header offset).
+
+    Pass an already fetched (headers, rows) snapshot to avoid another sheet download.
+    """
+    headers, rows = snapshot if snapshot is not None else _get_sheet_snapshot()
+    if "Data" not in headers or "Aluno(a)" not in headers:
         return None
-    # DataFrame index is zero-based for data rows (excluding header). Sheet rows add 2 (header + 1-indexing).
-    idx0 = int(df[mask].index[0])
-    return idx0 + 2
+    date_pos = headers.index("Data")
+    user_pos = headers.index("Aluno(a)")
+    user = user.lower()
+    # Data rows start at sheet row 2 (header + 1-indexing); the date is only parsed for matching students
+    for row_number, row in enumerate(rows, start=2):
+        try:
+            if row[user_pos].lower() != user:
+                continue
+            if datetime.strptime(row[date_pos], SHEET_DATE_FORMAT).date() == date_obj:
+                return row_number
+        except (ValueError, IndexError):
+            continue
+    return None
 
 
-def _ensure_row_for(date_obj: date, user: str) -> int:
-    """Ensure a row exists for (date, user). Return 1-based row index."""
-    row_idx = _find_row_index_for(date_obj, user)
-    if row_idx is not None:
-        return row_idx
+def _with_sheet_retries(action: Callable[[], Any], failure_log: str, failure_detail: str) -> Any:
+    """Run one Sheets write with up to 3 attempts and linear backoff.
+
+    Each call wraps a whole batch, so a failure is logged once per batch rather
+    than once per cell, and surfaces as HTTP 500 with ``failure_detail``.
+    """
+    for attempt in range(3):
+        try:
+            return action()
+        except Exception as e:
+            if attempt == 2:
+                logger.exception("%s: %s", failure_log, e)
+                raise HTTPException(status_code=500, detail=failure_detail)
+            time.sleep(0.4 * (attempt + 1))
 
-    if not hasattr(app.state, "worksheet") or app.state.worksheet is None:
-        raise HTTPException(status_code=503, detail="Serviço indisponível: planilha offline.")
 
-    worksheet = app.state.worksheet
+def _ensure_row_for(date_obj: date, user: str) -> Tuple[int, List[str]]:
+    """Ensure a row exists for (date, user). Return its 1-based row index and the sheet headers.
+
+    The headers come from the same snapshot used for the lookup, so callers can
+    pass them on to _safe_update_cells instead of downloading the sheet again.
+    """
+    # A single snapshot serves the lookup, the append offset and the caller's header map
     headers, rows = _get_sheet_snapshot()
+    row_idx = _find_row_index_for(date_obj, user, (headers, rows))
+    if row_idx is not None:
+        return row_idx, headers
+
+    worksheet = _require_worksheet()
     header_to_pos: Dict[str, int] = {h: i + 1 for i, h in enumerate(headers)}
 
     # Build a new row with defaults according to known columns
     new_row: List[str] = [""] * len(headers)
     if "Data" in header_to_pos:
-        new_row[header_to_pos["Data"] - 1] = date_obj.strftime("%d/%m/%Y")
+        new_row[header_to_pos["Data"] - 1] = date_obj.strftime(SHEET_DATE_FORMAT)
     if "Aluno(a)" in header_to_pos:
         new_row[header_to_pos["Aluno(a)"] - 1] = user
     if "Dia da Semana" in header_to_pos:
-        # Use pt-BR short weekday names
-        day_name = [
-            "Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado", "Domingo"
-        ][(date_obj.weekday()) % 7]
-        new_row[header_to_pos["Dia da Semana"] - 1] = day_name
+        new_row[header_to_pos["Dia da Semana"] - 1] = WEEKDAY_NAMES_PT[date_obj.weekday()]
 
-    # Append and compute the new row index (header row is 1)
-    for attempt in range(3):
-        try:
-            worksheet.append_row(new_row, value_input_option="USER_ENTERED")
-            # Row index is header (1) + number of existing data rows before append + 1
-            return 1 + len(rows) + 1
-        except Exception as e:
-            if attempt == 2:
-                logger.exception("Falha ao inserir nova linha: %s", e)
-                raise HTTPException(status_code=500, detail="Falha ao inserir linha no Sheets.")
-            time.sleep(0.4 * (attempt + 1))
+    _with_sheet_retries(
+        lambda: worksheet.append_row(new_row, value_input_option="USER_ENTERED"),
+        failure_log="Falha ao inserir nova linha",
+        failure_detail="Falha ao inserir linha no Sheets.",
+    )
+    # Row index is header (1) + number of existing data rows before append + 1
+    return 1 + len(rows) + 1, headers
 
 
-def _safe_update_cells(row_index: int, updates: Dict[str, Any]) -> None:
-    """Update multiple header-named cells in a given row with lightweight retries."""
-    if not hasattr(app.state, "worksheet") or app.state.worksheet is None:
-        raise HTTPException(status_code=503, detail="Serviço indisponível: planilha offline.")
-    worksheet = app.state.worksheet
-    headers, _ = _get_sheet_snapshot()
+def _safe_update_cells(row_index: int, updates: Dict[str, Any], headers: Optional[List[str]] = None) -> None:
+    """Update multiple header-named cells in a given row in a single batch request, with lightweight retries.
+
+    Pass already known sheet headers to skip re-downloading the sheet.
+    """
+    from gspread.utils import rowcol_to_a1
+
+    worksheet = _require_worksheet()
+    if headers is None:
+        headers, _ = _get_sheet_snapshot()
     if not headers:
         raise HTTPException(status_code=500, detail="Planilha sem cabeçalho.")
     header_to_pos: Dict[str, int] = {h: i + 1 for i, h in enumerate(headers)}
 
     # Prepare cell updates; ignore unknown headers gracefully
-    cell_updates: List[Tuple[int, int, Any]] = []
+    cell_updates: List[Dict[str, Any]] = []
     for header, value in updates.items():
         if header in header_to_pos:
-            cell_updates.append((row_index, header_to_pos[header], value))
+            cell_updates.append({
+                "range": rowcol_to_a1(row_index, header_to_pos[header]),
+                "values": [[value]],
+            })
         else:
             logger.debug("Cabeçalho não encontrado, ignorando update: %s", header)
+    if not cell_updates:
+        return
+
+    # One Sheets round-trip for the whole row instead of one per cell
+    _with_sheet_retries(
+        lambda: worksheet.batch_update(cell_updates, value_input_option="USER_ENTERED"),
+        failure_log=f"Falha ao atualizar linha r={row_index}",
+        failure_detail="Falha ao atualizar a planilha.",
+    )
 
-    for (r, c, v) in cell_updates:
-        for attempt in range(3):
-            try:
-                worksheet.update_cell(r, c, v)
-                break
-            except Exception as e:
-                if attempt == 2:
-                    logger.exception("Falha ao atualizar célula r=%s c=%s: %s", r, c, e)
-                    raise HTTPException(status_code=500, detail="Falha ao atualizar a planilha.")
-                time.sleep(0.4 * (attempt + 1))
 
 @app.get("/")
 def read_root():
@@ -254,59 +394,87 @@ def get_today_tasks(user: str):
         if df.empty: return []
         
         today = date.today()
-        df_today = df[df.get('Data', pd.Series(dtype='datetime64[ns]')).dt.date == today] if 'Data' in df.columns else df
-        if 'Aluno(a)' in df_today.columns:
-            df_user_today = df_today[
-                (df_today['Aluno(a)'].str.lower() == user.lower()) |
-                (df_today['Aluno(a)'].str.lower() == 'ambos')
-            ]
-        else:
-            df_user_today = df_today
-        df_user_today = df_user_today.fillna('').to_dict('records')
+        # Single fused mask: one boolean pass per column, one copy of the frame
+        mask = pd.Series(True, index=df.index)
+        if 'Data' in df.columns:
+            mask &= df['Data'] == pd.Timestamp(today)
+        mask &= _user_mask(df, user)
+        df_user_today = df.loc[mask].fillna('').to_dict('records')
         
         return df_user_today
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def groq_chat_json(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Ask Groq for a JSON-mode completion, serving repeated prompts from an in-process TTL cache.
+
+    Failures raise and are never cached, so callers keep their own fallbacks.
+    The returned dict is shared with the cache and must not be mutated.
+    """
+    key = json.dumps(messages, ensure_ascii=False)
+    now = time.monotonic()
+    with _ia_cache_lock:
+        hit = _ia_cache.get(key)
+        if hit is not None and now - hit[0] < IA_CACHE_TTL_SECONDS:
+            _ia_cache.move_to_end(key)
+            return hit[1]
+
+    payload = {
+        "model": GROQ_MODEL,
+        "messages": messages,
+        "temperature": 0.7,
+        "response_format": {"type": "json_object"},
+    }
+    response = groq_session.post(f"{GROQ_API_BASE}/chat/completions", json=payload, timeout=20)
+    response.raise_for_status()
+    data = json.loads(response.json()["choices"][0]["message"]["content"])  # type: ignore[index]
+
+    with _ia_cache_lock:
+        _ia_cache[key] = (now, data)
+        _ia_cache.move_to_end(key)
+        while len(_ia_cache) > IA_CACHE_MAX_ENTRIES:
+            _ia_cache.popitem(last=False)
+    return data
+
+
 class CoachRequest(BaseModel):
     subject: str
     activity: str
 
 @app.post("/coach", response_model=dict)
 def get_coach_advice(request: CoachRequest):
-    prompt = f'Você é o "System Coach" do Focus OS. Sua missão é gerar um plano tático e 2 flashcards. Responda EXCLUSIVAMENTE em JSON com chaves "summary" e "flashcards" (lista de objetos com "q" e "a"). MISSÃO: Matéria: {request.subject}, Atividade: {request.activity}'
+    prompt = COACH_PROMPT_TEMPLATE.format(subject=request.subject, activity=request.activity)
     try:
-        headers = {"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"}
-        payload = {"model": "gemma2-9b-it", "messages": [{"role": "user", "content": prompt}], "temperature": 0.7, "response_format": {"type": "json_object"}}
-        response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload, timeout=20)
-        response.raise_for_status()
-        return json.loads(response.json()['choices'][0]['message']['content'])
+        return groq_chat_json([{"role": "user", "content": prompt}])
     except Exception as e:
         logger.error("Falha na chamada à IA Groq: %s", e)
         return {"summary": f"// TRANSMISSÃO INTERROMPIDA // Plano de contingência para {request.subject}: Focar nos fundamentos. Revisar por 20min, praticar por 30min.", "flashcards": [{"q": "Principal objetivo?", "a": "Entender o conceito central."}, {"q": "O que evitar?", "a": "Distrações."}]}
 
 
-@app.on_event("startup")
-def on_startup() -> None:
-    logger.info("Iniciando Focus OS API...")
-    # Initialize Google Sheets
-    init_gsheets_state()
-
-    # Probe IA availability (non-fatal)
+def probe_ia_state() -> None:
+    """Probe Groq availability and record it in app state (non-fatal)."""
     app.state.ia_online = False
     try:
-        headers = {"Authorization": f"Bearer {GROQ_API_KEY}"}
-        resp = requests.get("https://api.groq.com/openai/v1/models", headers=headers, timeout=8)
+        resp = groq_session.get(f"{GROQ_API_BASE}/models", timeout=8)
         app.state.ia_online = resp.ok
         logger.info("IA Groq online: %s", app.state.ia_online)
     except Exception as e:
         logger.warning("Não foi possível verificar IA Groq: %s", e)
 
 
+def on_startup() -> None:
+    logger.info("Iniciando Focus OS API...")
+    # Sheets auth and the Groq probe are independent network round-trips: overlap them
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(init_gsheets_state), executor.submit(probe_ia_state)]
+        for future in futures:
+            future.result()
+
+
 @app.get("/status")
 def status() -> dict:
-    sheet_ok = hasattr(app.state, "worksheet") and app.state.worksheet is not None
-    last_error = getattr(app.state, "gs_last_error", None)
+    sheet_ok = app.state.worksheet is not None
+    last_error = app.state.gs_last_error
     worksheet_title = app.state.worksheet.title if sheet_ok else None
     return {
         "sheet": {
@@ -316,8 +484,8 @@ def status() -> dict:
             "last_error": last_error,
         },
         "ia": {
-            "online": bool(getattr(app.state, "ia_online", False)),
-            "model": "gemma2-9b-it",
+            "online": bool(app.state.ia_online),
+            "model": GROQ_MODEL,
         },
     }
 
@@ -334,28 +502,15 @@ class AskRequest(BaseModel):
 def ask_quiz(req: AskRequest):
     count = min(max(req.count or 3, 3), 5)
     mode = req.mode if req.mode in {"mcq", "truefalse", "mixed"} else "mixed"
-    system_prompt = (
-        "Gere perguntas curtas para revisão médica. Responda EM JSON. Estrutura: "
-        "{\"questions\":[{\"type\":\"mcq|truefalse\",\"question\":\"...\",\"options\":[\"A\",\"B\",...],\"answer\":\"A|true|false\",\"explanation\":\"...\"}]}"
-    )
     user_prompt = (
         f"Tópico: {req.topic}. Quantidade: {count}. Modo: {mode}. "
         "Se 'mcq', inclua 4 opções. Priorize alta qualidade e clareza."
     )
     try:
-        headers = {"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"}
-        payload = {
-            "model": "gemma2-9b-it",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            "temperature": 0.7,
-            "response_format": {"type": "json_object"},
-        }
-        response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload, timeout=20)
-        response.raise_for_status()
-        data = json.loads(response.json()["choices"][0]["message"]["content"])  # type: ignore[index]
+        data = groq_chat_json([
+            {"role": "system", "content": ASK_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ])
         # Normalize shape for frontend robustness
         questions = data.get("questions") or []
         normalized = []
@@ -411,27 +566,22 @@ def get_summary(user: str) -> dict:
 
         today = date.today()
         # Filter
-        df_user = df[(df.get("Aluno(a)", "").str.lower() == user.lower()) | (df.get("Aluno(a)", "").str.lower() == "ambos")]
-        df_recent = df_user.copy()
+        df_user = df[_user_mask(df, user)]
+        df_recent = df_user
         if "Data" in df_recent.columns:
             df_recent = df_recent.sort_values("Data", ascending=False)
 
         # Today stats
-        df_today = df_recent[df_recent["Data"].dt.date == today] if "Data" in df_recent.columns else pd.DataFrame()
+        df_today = df_recent[df_recent["Data"] == pd.Timestamp(today)] if "Data" in df_recent.columns else pd.DataFrame()
         pct = None
         diff = None
         status = None
         alert = None
         if not df_today.empty:
-            # Try to parse % Concluído (may contain % sign)
-            if "% Concluído" in df_today.columns:
-                val = str(df_today.iloc[0]["% Concluído"]).strip().replace("%", "")
-                pct = int(float(val)) if val.replace(".", "", 1).isdigit() else None
-            if "Dificuldade (1-5)" in df_today.columns:
-                try:
-                    diff = int(float(str(df_today.iloc[0]["Dificuldade (1-5)"])) )
-                except Exception:
-                    diff = None
+            # Numeric cells go through the shared vectorized parser (no per-field try/except)
+            first = df_today.iloc[:1]
+            pct = _optional_ints(_numeric_column(first, "% Concluído"))[0]
+            diff = _optional_ints(_numeric_column(first, "Dificuldade (1-5)"))[0]
             if "Status" in df_today.columns:
                 status = str(df_today.iloc[0]["Status"]).strip()
             if "Alerta/Comentário" in df_today.columns:
@@ -479,9 +629,9 @@ def update_progress(body: UpdateProgressRequest) -> dict:
         if not body.user:
             raise HTTPException(status_code=400, detail="Parâmetro 'user' é obrigatório.")
         target_date = (
-            datetime.strptime(body.date_str, "%d/%m/%Y").date() if body.date_str else date.today()
+            datetime.strptime(body.date_str, SHEET_DATE_FORMAT).date() if body.date_str else date.today()
         )
-        row_idx = _ensure_row_for(target_date, body.user)
+        row_idx, headers = _ensure_row_for(target_date, body.user)
 
         updates: Dict[str, Any] = {}
         # Map into sheet columns when present
@@ -491,7 +641,6 @@ def update_progress(body: UpdateProgressRequest) -> dict:
             updates["Questões Feitas"] = body.questoes_feitas
         # Support combined column if present
         if body.questoes_planejadas is not None or body.questoes_feitas is not None:
-            headers, _ = _get_sheet_snapshot()
             if "Questões Planejadas/Feitas" in headers:
                 qp = body.questoes_planejadas if body.questoes_planejadas is not None else ""
                 qf = body.questoes_feitas if body.questoes_feitas is not None else ""
@@ -508,7 +657,7 @@ def update_progress(body: UpdateProgressRequest) -> dict:
         if not updates:
             raise HTTPException(status_code=400, detail="Nenhum campo de progresso para atualizar.")
 
-        _safe_update_cells(row_idx, updates)
+        _safe_update_cells(row_idx, updates, headers)
         return {"ok": True, "row": row_idx}
     except HTTPException:
         raise
@@ -533,9 +682,9 @@ def update_meta(body: UpdateMetaRequest) -> dict:
         if not body.user:
             raise HTTPException(status_code=400, detail="Parâmetro 'user' é obrigatório.")
         target_date = (
-            datetime.strptime(body.date_str, "%d/%m/%Y").date() if body.date_str else date.today()
+            datetime.strptime(body.date_str, SHEET_DATE_FORMAT).date() if body.date_str else date.today()
         )
-        row_idx = _ensure_row_for(target_date, body.user)
+        row_idx, headers = _ensure_row_for(target_date, body.user)
 
         updates: Dict[str, Any] = {}
         if body.dificuldade is not None:
@@ -555,7 +704,7 @@ def update_meta(body: UpdateMetaRequest) -> dict:
         if not updates:
             raise HTTPException(status_code=400, detail="Nenhum campo de meta para atualizar.")
 
-        _safe_update_cells(row_idx, updates)
+        _safe_update_cells(row_idx, updates, headers)
         return {"ok": True, "row": row_idx}
     except HTTPException:
         raise
@@ -571,34 +720,22 @@ def history(user: str) -> dict:
         if df.empty:
             return {"history": []}
         # Filter by user or 'Ambos'
-        mask_user = (df.get("Aluno(a)", "").str.lower() == user.lower()) | (df.get("Aluno(a)", "").str.lower() == "ambos")
-        df_user = df[mask_user].copy()
+        df_user = df[_user_mask(df, user)]
         if "Data" not in df_user.columns:
             return {"history": []}
         # Keep last 14 days including today
         start_date = date.today() - timedelta(days=13)
-        df_user = df_user[(df_user["Data"].dt.date >= start_date) & (df_user["Data"].dt.date <= date.today())]
-        # Build records
-        records: List[Dict[str, Any]] = []
-        for _, row in df_user.sort_values("Data").iterrows():
-            pct_val = None
-            if "% Concluído" in df_user.columns:
-                raw = str(row.get("% Concluído", "")).strip().replace("%", "")
-                try:
-                    pct_val = int(float(raw))
-                except Exception:
-                    pct_val = None
-            diff_val = None
-            if "Dificuldade (1-5)" in df_user.columns:
-                try:
-                    diff_val = int(float(str(row.get("Dificuldade (1-5)", ""))))
-                except Exception:
-                    diff_val = None
-            records.append({
-                "date": row["Data"].strftime("%d/%m"),
-                "percent": pct_val,
-                "difficulty": diff_val,
-            })
+        df_user = df_user[df_user["Data"].between(pd.Timestamp(start_date), pd.Timestamp(date.today()))]
+        df_user = df_user.sort_values("Data")
+        # Build records column-wise: no per-row Series boxing
+        records: List[Dict[str, Any]] = [
+            {"date": d, "percent": p, "difficulty": f}
+            for d, p, f in zip(
+                df_user["Data"].dt.strftime("%d/%m"),
+                _optional_ints(_numeric_column(df_user, "% Concluído")),
+                _optional_ints(_numeric_column(df_user, "Dificuldade (1-5)")),
+            )
+        ]
         return {"history": records}
     except Exception as e:
         logger.exception("Erro em /history: %s", e)
@@ -0,0 +1,65 @@
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("GCP_SERVICE_ACCOUNT_JSON", "{}")
+os.environ.setdefault("GROQ_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+HEADERS = ["Data", "Aluno(a)", "% Concluído", "Dificuldade (1-5)", "Status", "Alerta/Comentário"]
+
+
+class FakeWorksheet:
+    """Minimal stand-in for a gspread worksheet: only the read path the endpoints use."""
+
+    title = "Test"
+
+    def __init__(self, rows):
+        self.values = [HEADERS] + rows
+
+    def get_all_values(self):
+        return [list(r) for r in self.values]
+
+
+@pytest.fixture
+def client_with_rows():
+    def make(rows):
+        main.app.state.worksheet = FakeWorksheet(rows)
+        return TestClient(main.app)
+
+    yield make
+    main.app.state.worksheet = None
+
+
+def _fmt(d: date) -> str:
+    return d.strftime(main.SHEET_DATE_FORMAT)
+
+
+def test_summary_non_finite_cells_become_none(client_with_rows):
+    client = client_with_rows([[_fmt(date.today()), "Mateus", "inf", "1e999", "Ok", ""]])
+
+    r = client.get("/summary/mateus")
+
+    assert r.status_code == 200
+    stats = r.json()["stats"]
+    assert stats["today_percent"] is None
+    assert stats["today_difficulty"] is None
+
+
+def test_history_non_finite_cells_become_none(client_with_rows):
+    today = date.today()
+    client = client_with_rows([
+        [_fmt(today - timedelta(days=1)), "Mateus", "-Infinity", "inf", "", ""],
+        [_fmt(today), "Mateus", "50%", "3", "", ""],
+    ])
+
+    r = client.get("/history/mateus")
+
+    assert r.status_code == 200
+    history = r.json()["history"]
+    assert [(h["percent"], h["difficulty"]) for h in history] == [(None, None), (50, 3)]
@@ -1,10 +1,65 @@
 # optimize_cli.py
 # Uso: roda no servidor (GitHub Actions) para executar otimização noturna automaticamente
-import os, json, requests
-from datetime import date
+import os, json, asyncio
+import httpx
+import orjson
+from datetime import date, datetime
+from functools import lru_cache
 from dateutil.parser import parse as parse_date
 import gspread
+import pandas as pd
 from google.oauth2.service_account import Credentials
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+@lru_cache(maxsize=4096)
+def _fast_parse(d):
+    """Converte a data da planilha (dd/mm/yyyy) em date; só cai no dateutil (lento) para outros formatos."""
+    try:
+        return datetime.strptime(d, "%d/%m/%Y").date()
+    except ValueError:
+        return parse_date(d, dayfirst=True).date()
+
+_decoder = json.JSONDecoder()
+
+def _extract_json(text):
+    """Acha o primeiro objeto JSON válido no texto da IA (raw_decode a partir de cada '{'); None se não houver."""
+    start = text.find("{")
+    while start != -1:
+        try:
+            return _decoder.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            start = text.find("{", start + 1)
+    return None
+
+def _has_moves(result):
+    """Resposta da IA só é aceita se for um objeto JSON com a chave 'moves'."""
+    return isinstance(result, dict) and "moves" in result
+
+def _is_rate_limited(exc):
+    """Só o 429 (cota de escrita/leitura do Sheets) vale nova tentativa; outros erros sobem direto."""
+    return isinstance(exc, gspread.exceptions.APIError) and exc.response.status_code == 429
+
+@retry(retry=retry_if_exception(_is_rate_limited), wait=wait_random_exponential(multiplier=1, max=60),
+       stop=stop_after_attempt(5), reraise=True)
+def _sheets_call(fn, *args, **kwargs):
+    """Executa uma chamada do gspread com backoff exponencial em caso de 429."""
+    return fn(*args, **kwargs)
+
+# Nomes das colunas da planilha
+COL_DATA = "Data"
+COL_STATUS = "Status"
+COL_ALUNO = "Aluno(a)"
+COL_EXAME = "Exame"
+COL_MANHA_PCT = "% Concluído (Manhã)"
+COL_TARDE_PCT = "% Concluído (Tarde)"
+COL_NOITE_PCT = "% Concluído (Noite)"
+COL_MANHA_MATERIA = "Matéria (Manhã)"
+COL_MANHA_ATIVIDADE = "Atividade Detalhada (Manhã)"
+COL_TARDE_ATIVIDADE = "Atividade Detalhada (Tarde)"
+COL_NOITE_ATIVIDADE = "Atividade Detalhada (Noite)"
+
+# Valores de "Status" que contam como concluído (frozenset: teste de pertinência O(1), sem lista por linha)
+COMPLETED_STATUSES = frozenset({True, "TRUE", "True", 1, "1"})
 
 # Carrega o service account JSON do env var (no GitHub Actions você deve configurar como secret)
 sa_json = os.environ.get("GCP_SERVICE_ACCOUNT_JSON")
@@ -15,45 +70,88 @@ if not sa_json or not spreadsheet:
     print("Falta GCP_SERVICE_ACCOUNT_JSON ou SPREADSHEET_ID_OR_URL")
     exit(1)
 
-sa = json.loads(sa_json)
-scopes = ["https://www.googleapis.com/auth/spreadsheets","https://www.googleapis.com/auth/drive"]
-creds = Credentials.from_service_account_info(sa, scopes=scopes)
-gc = gspread_authorize(creds) # Renomeado para evitar conflito com gspread
-if spreadsheet.startswith("http"):
-    sh = gc.open_by_url(spreadsheet)
-else:
-    sh = gc.open_by_key(spreadsheet)
-ws = sh.worksheet(tab_name)
-data = ws.get_all_records()
-
-# construir pendings
-pendings = []
-today = date.today()
-for i, row in enumerate(data):
-    d = row.get(COL_DATA)
-    if isinstance(d, str) and d.strip() == "":
-        continue
+SCOPES = ("https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive")
+
+@lru_cache(maxsize=1)
+def _get_client():
+    """Autentica uma vez por processo e devolve (gc, sh, ws); chamadas seguintes reusam o mesmo cliente."""
+    creds = Credentials.from_service_account_info(json.loads(sa_json), scopes=SCOPES)
+    # gspread.authorize já usa uma AuthorizedSession que renova e reaproveita o token
+    gc = gspread.authorize(creds)
+    if spreadsheet.startswith("http"):
+        sh = _sheets_call(gc.open_by_url, spreadsheet)
+    else:
+        sh = _sheets_call(gc.open_by_key, spreadsheet)
+    ws = _sheets_call(sh.worksheet, tab_name)
+    return gc, sh, ws
+
+gc, sh, ws = _get_client()
+# Cabeçalho lido uma única vez por execução; não muda durante o run
+HEADER = _sheets_call(ws.row_values, 1)
+HMAP = {h:i for i,h in enumerate(HEADER)}
+
+# Lê só o bloco de colunas usado pelas pendências
+PENDING_COLS = (
+    COL_DATA, COL_STATUS, COL_ALUNO, COL_EXAME, COL_MANHA_PCT, COL_TARDE_PCT, COL_NOITE_PCT,
+    COL_MANHA_MATERIA, COL_MANHA_ATIVIDADE,
+)
+_col_idx = [HMAP[c] for c in PENDING_COLS if c in HMAP] or [0]
+FIRST_COL, LAST_COL = min(_col_idx), max(_col_idx)
+data_range = gspread.utils.rowcol_to_a1(2, FIRST_COL + 1) + ":" + gspread.utils.rowcol_to_a1(1, LAST_COL + 1).rstrip("0123456789")
+# Valores formatados (padrão), iguais aos de antes: datas dd/mm/yyyy e percentuais inteiros
+data = _sheets_call(ws.get, data_range)
+
+# construir pendings: um filtro vetorizado (pandas) sobre todas as linhas em vez de um loop por linha.
+# Colunas rotuladas pelo índice na planilha; células vazias cortadas no fim da linha viram NaN.
+df = pd.DataFrame(data).reindex(columns=range(LAST_COL - FIRST_COL + 1))
+df.columns = range(FIRST_COL, LAST_COL + 1)
+df.index += 2  # número da linha na planilha (cabeçalho = 1)
+
+def text(frame, name):
+    """Coluna `name` de `frame` como texto ("" para vazio/ausente)."""
+    if name not in HMAP:
+        return pd.Series("", index=frame.index)
+    return frame[HMAP[name]].fillna("").astype(str)
+
+def pct(frame, name):
+    return pd.to_numeric(text(frame, name), errors="coerce").fillna(0).astype(int)
+
+def _try_parse(d):
     try:
-        dobj = parse_date(d, dayfirst=True).date()
-    except:
-        continue
-    status = row.get(COL_STATUS)
-    if dobj < today and status not in COMPLETED_STATUSES:
-        pendings.append({
-            "row_index": i+2,
-            "date": dobj.strftime("%d/%m/%Y"),
-            "aluno": row.get(COL_ALUNO),
-            "exame": row.get(COL_EXAME),
-            "manhaPct": int(row.get(COL_MANHA_PCT) or 0),
-            "tardePct": int(row.get(COL_TARDE_PCT) or 0),
-            "noitePct": int(row.get(COL_NOITE_PCT) or 0),
-            "manhaTask": f"{row.get(COL_MANHA_MATERIA) or ''} - {row.get(COL_MANHA_ATIVIDADE) or ''}"
-        })
+        return _fast_parse(d)
+    except Exception:
+        return None
+
+today = date.today()
+raw_dates = text(df, COL_DATA).str.strip()
+dates = pd.to_datetime(raw_dates, format="%d/%m/%Y", errors="coerce")
+# Formatos fora do padrão (raros) ainda passam pelo parser tolerante
+odd = dates.isna() & (raw_dates != "")
+if odd.any():
+    dates[odd] = pd.to_datetime(raw_dates[odd].map(_try_parse), errors="coerce")
+
+mask = (dates < pd.Timestamp(today)) & ~text(df, COL_STATUS).isin(COMPLETED_STATUSES)
+pending, pending_dates = df[mask], dates[mask]
+pendings = pd.DataFrame({
+    "date": pending_dates.dt.strftime("%d/%m/%Y"),
+    "aluno": text(pending, COL_ALUNO),
+    "exame": text(pending, COL_EXAME),
+    "manhaPct": pct(pending, COL_MANHA_PCT),
+    "tardePct": pct(pending, COL_TARDE_PCT),
+    "noitePct": pct(pending, COL_NOITE_PCT),
+    "manhaTask": text(pending, COL_MANHA_MATERIA) + " - " + text(pending, COL_MANHA_ATIVIDADE),
+}).rename_axis("row_index").reset_index().to_dict(orient="records")
 
 if not pendings:
     print("Nenhuma pendência antiga encontrada.")
     exit(0)
 
+# Instruções fixas do prompt; só as linhas de pendências variam
+PROMPT_PREFIX = (
+    "RETORNE SOMENTE UM JSON VÁLIDO com chave 'moves' (subject, from, to, period, reason).\n"
+    "Sugira reagendamento JSON com moves[] para essas pendências:\n"
+)
+
 # Chamar IA para otimizar - usa GROQ ou OPENAI via env vars
 groq_key = os.environ.get("GROQ_API_KEY")
 groq_url = os.environ.get("GROQ_API_URL", "https://api.groq.ai/v1")
@@ -62,51 +160,76 @@ openai_key = os.environ.get("OPENAI_API_KEY")
 pending_lines = "\n".join([
     f"- {p['date']}: {p['aluno']} - {p['exame']} - Manhã {p['manhaPct']}% ({p['manhaTask']})" for p in pendings
 ])
-prompt = f"RETORNE SOMENTE UM JSON VÁLIDO com chave 'moves' (subject, from, to, period, reason).\nSugira reagendamento JSON com moves[] para essas pendências:\n{pending_lines}"
+prompt = PROMPT_PREFIX + pending_lines
+
+# AI_COST_MODE=1 volta ao modo sequencial (OpenAI só se a Groq falhar) para não pagar duas chamadas
+cost_mode = os.environ.get("AI_COST_MODE") == "1"
 
-def call_groq(prompt):
+async def call_groq(client, prompt):
     headers = {"Authorization": f"Bearer {groq_key}", "Content-Type":"application/json"}
     payload = {"prompt": prompt, "max_tokens": 800}
-    resp = requests.post(groq_url, headers=headers, json=payload, timeout=30)
-    return resp
+    resp = await client.post(groq_url, headers=headers, json=payload)
+    resp.raise_for_status() # Lança exceção para status de erro (4xx ou 5xx)
+    return resp.text
 
-def call_openai(prompt):
-    import openai
-    openai.api_key = openai_key
+async def call_openai(client, prompt):
+    from openai import AsyncOpenAI
     messages = [{"role":"system","content":"Organizador de estudos."},{"role":"user","content":prompt}]
-    resp = openai.ChatCompletion.create(model="gpt-4o-mini", messages=messages, max_tokens=800, temperature=0.2)
-    return resp.choices[0].message["content"]
+    resp = await AsyncOpenAI(api_key=openai_key, http_client=client).chat.completions.create(model="gpt-4o-mini", messages=messages, max_tokens=800, temperature=0.2)
+    return resp.choices[0].message.content
 
-def get_ai_suggestion(prompt):
-    """Tenta obter a sugestão da IA, primeiro com Groq, depois com OpenAI como fallback."""
-    def parse_response(text):
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            import re
-            match = re.search(r'\{[\s\S]*\}', text)
-            if match:
-                return json.loads(match.group(0))
-        return None
+def parse_response(text):
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return _extract_json(text)
 
+async def _ask_providers(prompt):
+    providers = []
     if groq_key:
-        try:
-            print("Tentando chamada com Groq...")
-            r = call_groq(prompt)
-            r.raise_for_status() # Lança exceção para status de erro (4xx ou 5xx)
-            return parse_response(r.text)
-        except Exception as e:
-            print(f"Erro na chamada com Groq: {e}")
-
+        providers.append(("Groq", call_groq))
     if openai_key:
+        providers.append(("OpenAI", call_openai))
+    # Um cliente HTTP/2 por execução, compartilhado pelos provedores (keep-alive + multiplexação)
+    async with httpx.AsyncClient(http2=True, timeout=30) as client:
+        if cost_mode:
+            for name, call in providers:
+                try:
+                    print(f"Tentando chamada com {name}...")
+                    result = parse_response(await call(client, prompt))
+                    if _has_moves(result):
+                        return result
+                    print(f"Resposta sem 'moves' de {name}")
+                except Exception as e:
+                    print(f"Erro na chamada com {name}: {e}")
+            return None
+
+        # Dispara todos os provedores juntos; a primeira resposta com 'moves' vence e as demais são canceladas
+        print("Tentando chamadas com", ", ".join(name for name, _ in providers) + "...")
+        tasks = {asyncio.create_task(call(client, prompt)): name for name, call in providers}
+        pending = set(tasks)
         try:
-            print("Tentando chamada com OpenAI...")
-            text = call_openai(prompt)
-            return parse_response(text)
-        except Exception as e:
-            print(f"Erro na chamada com OpenAI: {e}")
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        result = parse_response(task.result())
+                    except Exception as e:
+                        print(f"Erro na chamada com {tasks[task]}: {e}")
+                        continue
+                    if _has_moves(result):
+                        return result
+                    print(f"Resposta sem 'moves' de {tasks[task]}")
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
     return None
 
+def get_ai_suggestion(prompt):
+    """Obtém a sugestão da IA consultando Groq e OpenAI em paralelo (ou em sequência com AI_COST_MODE=1)."""
+    return asyncio.run(_ask_providers(prompt))
+
 resp_obj = get_ai_suggestion(prompt)
 if not resp_obj:
     print("Nenhuma resposta válida de IA; encerrando.")
@@ -116,16 +239,15 @@ moves = resp_obj.get("moves", [])
 print("Moves recebidos:", moves)
 
 # Aplicar moves (simplificado): vamos apenas anexar novas linhas com a data target e subject
-for mv in moves:
+def _build_row(mv, header, hmap):
+    """Monta a linha da planilha para um move (função pura, sem I/O)."""
     to = mv.get("to")
     subject = mv.get("subject")
     period = mv.get("period", "manha")
-    row = [None] * len(ws.row_values(1))
-    header = ws.row_values(1)
-    hmap = {h:i for i,h in enumerate(header)}
+    row = [None] * len(header)
     if COL_DATA in hmap:
         try:
-            parsed = parse_date(to, dayfirst=True).date()
+            parsed = _fast_parse(to)
             row[hmap[COL_DATA]] = parsed.strftime("%d/%m/%Y")
         except:
             row[hmap[COL_DATA]] = to
@@ -135,6 +257,34 @@ for mv in moves:
         row[hmap[COL_TARDE_ATIVIDADE]] = subject
     elif COL_NOITE_ATIVIDADE in hmap: # Fallback para noite
         row[hmap[COL_NOITE_ATIVIDADE]] = subject
-    ws.append_row(row)
+    return row
+
+SHEETS_EPOCH = date(1899, 12, 30)  # dia 0 do número serial de datas do Sheets
+
+def _to_cell(value, is_date):
+    """CellData do appendCells: datas válidas viram serial com formato dd/mm/yyyy, o resto texto."""
+    if value is None:
+        return {}
+    if is_date:
+        try:
+            serial = (_fast_parse(value) - SHEETS_EPOCH).days
+            return {"userEnteredValue": {"numberValue": serial},
+                    "userEnteredFormat": {"numberFormat": {"type": "DATE", "pattern": "dd/mm/yyyy"}}}
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+batch_rows = [_build_row(mv, HEADER, HMAP) for mv in moves]
+
+# Todas as linhas vão num único spreadsheets.batchUpdate com appendCells (1 chamada à API,
+# sem o values.append ter que procurar a última linha da tabela)
+if batch_rows:
+    date_col = HMAP.get(COL_DATA)
+    append_cells = {
+        "sheetId": ws.id,
+        "rows": [{"values": [_to_cell(v, i == date_col) for i, v in enumerate(row)]} for row in batch_rows],
+        "fields": "userEnteredValue,userEnteredFormat.numberFormat",
+    }
+    _sheets_call(sh.batch_update, {"requests": [{"appendCells": append_cells}]})
 
 print("Aplicação concluída.")
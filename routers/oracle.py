@@ -1,19 +1,81 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple, AsyncIterator
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 import httpx
+import json
+import orjson
 from datetime import datetime
 import asyncio
-import json
+import logging
 import os
+import time
 
 # Configuração
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY environment variable is not set")
 
-router = APIRouter()
+GROQ_CHAT_URL = "https://api.groq.com/v1/chat/completions"
+
+logger = logging.getLogger(__name__)
+
+# Partes fixas do prompt ficam no início e byte a byte idênticas entre requisições,
+# para o cache de prompt da Groq reaproveitar o prefixo; só o contexto varia no fim
+STATIC_SYSTEM_PROMPT = "Você é o Oráculo, um mentor estratégico do Focus OS."
+STATIC_PROMPT_PREFIX = """Você é o Oráculo do Focus OS, um mentor estratégico para estudantes.
+
+Com base nos dados do CONTEXTO DA MISSÃO abaixo, gere:
+1. Uma mensagem motivacional e estratégica personalizada
+2. Três focos táticos específicos para esta sessão
+3. Uma análise de performance baseada no histórico
+4. Uma estimativa de conclusão (em porcentagem)
+
+Formato: JSON
+
+"""
+CONTEXT_TEMPLATE = """CONTEXTO DA MISSÃO:
+- Matéria: {subject}
+- Atividade: {activity}
+- Dificuldade Reportada: {difficulty}/10
+- Último Comentário: {comment}
+- Prioridade: {priority}
+"""
+
+# Tokens de prompt enviados vs. servidos do cache da Groq (acumulado no processo)
+_prompt_token_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+
+# Cliente único por ciclo de vida do app: reaproveita conexões TLS e multiplexa via HTTP/2.
+# Criado sob demanda e recriado se um lifespan anterior já o fechou
+_client: Optional[httpx.AsyncClient] = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            headers={
+                "Authorization": f"Bearer {GROQ_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=10.0
+        )
+    return _client
+
+# O FastAPI junta este lifespan ao do app no include_router; fecha o cliente no shutdown
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global _client
+    _get_client()
+    yield
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+router = APIRouter(lifespan=lifespan)
 
 class TaskContext(BaseModel):
     subject: str
@@ -28,77 +90,205 @@ class OracleBriefing(BaseModel):
     performance_insight: str
     completion_estimate: int
 
-@router.post("/oracle/briefing")
-async def get_oracle_briefing(context: TaskContext):
-    try:
-        # Construir um prompt personalizado e empático
-        prompt = f"""
-        Você é o Oráculo do Focus OS, um mentor estratégico para {context.subject}.
-        
-        CONTEXTO DA MISSÃO:
-        - Matéria: {context.subject}
-        - Atividade: {context.activity}
-        - Dificuldade Reportada: {context.difficulty}/10
-        - Último Comentário: {context.comment or 'Nenhum comentário anterior'}
-        - Prioridade: {context.priority}
-        
-        Com base nestes dados, gere:
-        1. Uma mensagem motivacional e estratégica personalizada
-        2. Três focos táticos específicos para esta sessão
-        3. Uma análise de performance baseada no histórico
-        4. Uma estimativa de conclusão (em porcentagem)
-        
-        Formato: JSON
-        """
+# Cache TTL+LRU dos briefings: o prompt depende só do TaskContext
+BRIEFING_CACHE_TTL_SECONDS = 600
+BRIEFING_CACHE_MAX_ENTRIES = 2048
+_briefing_cache: "OrderedDict[tuple, Tuple[float, OracleBriefing]]" = OrderedDict()
+# Requisições idênticas simultâneas esperam a primeira em vez de chamar a IA de novo
+_briefing_inflight: Dict[tuple, asyncio.Event] = {}
+
+def _briefing_cache_key(context: TaskContext) -> tuple:
+    return (context.subject, context.activity, context.difficulty, context.comment or "", context.priority)
+
+def _briefing_cache_get(key: tuple) -> Optional[OracleBriefing]:
+    entry = _briefing_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, briefing = entry
+    if expires_at < time.monotonic():
+        del _briefing_cache[key]
+        return None
+    _briefing_cache.move_to_end(key)
+    return briefing
+
+def _briefing_cache_put(key: tuple, briefing: OracleBriefing) -> None:
+    _briefing_cache[key] = (time.monotonic() + BRIEFING_CACHE_TTL_SECONDS, briefing)
+    _briefing_cache.move_to_end(key)
+    while len(_briefing_cache) > BRIEFING_CACHE_MAX_ENTRIES:
+        _briefing_cache.popitem(last=False)
+
+def _log_prompt_cache_usage(result: dict) -> None:
+    usage = result.get('usage') or result.get('x_groq', {}).get('usage') or {}
+    prompt_tokens = usage.get('prompt_tokens') or 0
+    cached_tokens = usage.get('cached_tokens') or (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+    _prompt_token_stats["prompt_tokens"] += prompt_tokens
+    _prompt_token_stats["cached_tokens"] += cached_tokens
+    total = _prompt_token_stats["prompt_tokens"]
+    hit_rate = _prompt_token_stats["cached_tokens"] / total if total else 0.0
+    logger.info("Groq prompt cache: %s/%s tokens em cache (taxa acumulada %.1f%%)", cached_tokens, prompt_tokens, hit_rate * 100)
+
+def _briefing_payload(context: TaskContext, stream: bool = False) -> dict:
+    # Só o bloco de contexto é montado por requisição
+    prompt = STATIC_PROMPT_PREFIX + CONTEXT_TEMPLATE.format(
+        subject=context.subject,
+        activity=context.activity,
+        difficulty=context.difficulty,
+        comment=context.comment or 'Nenhum comentário anterior',
+        priority=context.priority
+    )
+    payload = {
+        "model": "gemma2-9b-it",
+        "messages": [
+            {"role": "system", "content": STATIC_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 500,
+        "response_format": {"type": "json_object"}
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+async def _request_briefing(context: TaskContext) -> OracleBriefing:
+    response = await _get_client().post(GROQ_CHAT_URL, json=_briefing_payload(context))
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Erro ao se comunicar com a IA: {response.text}"
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.groq.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {GROQ_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gemma2-9b-it",
-                    "messages": [
-                        {"role": "system", "content": "Você é o Oráculo, um mentor estratégico do Focus OS."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 500,
-                    "response_format": {"type": "json_object"}
-                },
-                timeout=10.0
-            )
-            
+    result = orjson.loads(response.content)
+    _log_prompt_cache_usage(result)
+    # Pydantic valida o JSON do modelo direto da string, sem json.loads intermediário
+    return OracleBriefing.model_validate_json(result['choices'][0]['message']['content'])
+
+_json_decoder = json.JSONDecoder()
+
+FOCUS_KEY = '"tactical_focus"'
+
+def _scan_focus_items(buffer: str, pos: int) -> Tuple[List[str], int, bool]:
+    """Decodifica os itens de tactical_focus já fechados a partir de pos (logo após o '[' ou o último item).
+
+    Devolve (itens novos, posição para retomar, lista terminou).
+    """
+    items = []
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(buffer):
+            return items, pos, False
+        if buffer[pos] == ']':
+            return items, pos, True
+        try:
+            item, end = _json_decoder.raw_decode(buffer, pos)
+        except ValueError:
+            return items, pos, False
+        items.append(item)
+        pos = end
+
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+async def _stream_briefing(context: TaskContext, key: tuple) -> AsyncIterator[bytes]:
+    """Repassa o briefing via SSE: cada foco tático assim que fecha, e o briefing validado no fim."""
+    cached = _briefing_cache_get(key)
+    if cached is not None:
+        for item in cached.tactical_focus:
+            yield _sse("focus", item)
+        yield _sse("briefing", cached.model_dump())
+        return
+    try:
+        async with _get_client().stream("POST", GROQ_CHAT_URL, json=_briefing_payload(context, stream=True)) as response:
             if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Erro ao se comunicar com a IA: {response.text}"
-                )
-                
-            result = response.json()
-            briefing_data = json.loads(result['choices'][0]['message']['content'])
-            
-            return OracleBriefing(
-                message=briefing_data['message'],
-                tactical_focus=briefing_data['tactical_focus'],
-                performance_insight=briefing_data['performance_insight'],
-                completion_estimate=briefing_data['completion_estimate']
-            )
+                body = await response.aread()
+                yield _sse("error", {"detail": f"Erro ao se comunicar com a IA: {body.decode(errors='replace')}"})
+                return
+            buffer = ""
+            key_pos = None    # início de "tactical_focus" no buffer
+            focus_pos = None  # onde retomar a leitura dos itens da lista
+            focus_done = False
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = orjson.loads(data)
+                # O uso só vem no último chunk; os anteriores trazem x_groq apenas com o id
+                if chunk.get('usage') or chunk.get('x_groq', {}).get('usage'):
+                    _log_prompt_cache_usage(chunk)
+                if not chunk.get('choices'):
+                    continue
+                delta = chunk['choices'][0].get('delta', {}).get('content')
+                if not delta:
+                    continue
+                # Cada trecho só é varrido uma vez: as buscas retomam de onde pararam
+                search_from = max(0, len(buffer) - len(FOCUS_KEY) + 1)
+                buffer += delta
+                if key_pos is None:
+                    found = buffer.find(FOCUS_KEY, search_from)
+                    key_pos = found if found != -1 else None
+                if key_pos is not None and focus_pos is None:
+                    bracket = buffer.find('[', key_pos + len(FOCUS_KEY))
+                    focus_pos = bracket + 1 if bracket != -1 else None
+                if focus_pos is not None and not focus_done:
+                    items, focus_pos, focus_done = _scan_focus_items(buffer, focus_pos)
+                    for item in items:
+                        yield _sse("focus", item)
+        briefing = OracleBriefing.model_validate_json(buffer)
+        _briefing_cache_put(key, briefing)
+        yield _sse("briefing", briefing.model_dump())
+    except httpx.TimeoutException:
+        yield _sse("error", {"detail": "Tempo limite excedido ao consultar a IA"})
+    except Exception as e:
+        yield _sse("error", {"detail": f"Erro interno: {str(e)}"})
+
+# Com response_model o FastAPI serializa o briefing direto para bytes JSON via pydantic-core
+@router.post("/oracle/briefing", response_model=OracleBriefing)
+async def get_oracle_briefing(context: TaskContext, request: Request):
+    key = _briefing_cache_key(context)
+    # Clientes que aceitam SSE recebem o briefing em partes; os demais, o JSON completo
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(_stream_briefing(context, key), media_type="text/event-stream")
+    try:
+        cached = _briefing_cache_get(key)
+        if cached is not None:
+            return cached
+
+        # Espera quem já está buscando este contexto; se o líder falhou, só um dos que
+        # esperavam assume (o laço volta a esperar se outro já registrou um novo Event)
+        while (pending := _briefing_inflight.get(key)) is not None:
+            await pending.wait()
+            cached = _briefing_cache_get(key)
+            if cached is not None:
+                return cached
+
+        done = asyncio.Event()
+        _briefing_inflight[key] = done
+        try:
+            briefing = await _request_briefing(context)
+            _briefing_cache_put(key, briefing)
+            return briefing
+        finally:
+            if _briefing_inflight.get(key) is done:
+                del _briefing_inflight[key]
+            done.set()
             
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Tempo limite excedido ao consultar a IA")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
-# Middleware para tratamento de erros
-@router.middleware("http")
-async def error_handler(request, call_next):
-    try:
-        return await call_next(request)
-    except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content={"detail": "O Oráculo está temporariamente indisponível. Tente novamente em alguns momentos."}
-        )
\ No newline at end of file
+# Tratamento de erros: APIRouter não aceita middleware, então o handler é registrado
+# no app que incluir este router (register_exception_handlers(app))
+async def oracle_unavailable_handler(request: Request, exc: Exception):
+    logger.exception("Erro não tratado em %s", request.url.path, exc_info=exc)
+    return JSONResponse(
+        status_code=500,
+        content={"detail": "O Oráculo está temporariamente indisponível. Tente novamente em alguns momentos."}
+    )
+
+def register_exception_handlers(app: FastAPI) -> None:
+    app.add_exception_handler(Exception, oracle_unavailable_handler)